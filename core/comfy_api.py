@@ -1,44 +1,130 @@
 # core/comfy_api.py
 
-import json
 import uuid
-import requests
-import websocket
-import threading
 import time
+import threading
+from functools import lru_cache
+from urllib.parse import urlencode
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from typing import Optional
+
+from core.settings import COMFY_API_URL, WORKFLOW_PATH, WS_POOL_SIZE, DEBUG
+from core.ws_client import ComfyWSClient, WSPool
+
+# Таймауты (connect, read) для HTTP-запросов к ComfyUI
+HTTP_TIMEOUT = (2, 30)
+
+_VIEW_BASE = f"{COMFY_API_URL}/view"
+
+# Паузы (секунды) между повторными запросами истории, если результат не пришёл по WebSocket
+HISTORY_RETRY_DELAYS = (0.1, 0.2, 0.4, 0.8, 1.5)
 
-from core.settings import COMFY_API_URL, WORKFLOW_PATH, DEBUG
+# Общая сессия: keep-alive переиспользует одно TCP-соединение
+# на весь цикл генерация → история → скачивание
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.1),
+))
 
 
+def get_session() -> requests.Session:
+    """Возвращает общую HTTP-сессию для запросов к ComfyUI."""
+    return _SESSION
+
 def generate_client_id() -> str:
     return str(uuid.uuid4())
 
+# Долгоживущие WebSocket-клиенты по client_id (одно соединение на клиента)
+_WS_CLIENTS: dict[str, ComfyWSClient] = {}
+_WS_LOCK = threading.Lock()
+_WS_POOL: Optional[WSPool] = None
+
+def _start_ws_client(client_id: str) -> ComfyWSClient:
+    # Вызывается под _WS_LOCK
+    client = ComfyWSClient(client_id)
+    client.start()
+    _WS_CLIENTS[client_id] = client
+    return client
+
+def get_ws_client(client_id: str) -> ComfyWSClient:
+    """Возвращает запущенный WebSocket-клиент для client_id, создавая его при первом обращении."""
+    with _WS_LOCK:
+        return _WS_CLIENTS.get(client_id) or _start_ws_client(client_id)
+
+def start_ws_pool() -> WSPool:
+    """
+    Открывает WS_POOL_SIZE соединений с ComfyUI (один раз за время жизни приложения).
+    Вызывается при старте интерфейса, чтобы handshake не попадал на время генерации.
+    """
+    global _WS_POOL
+    with _WS_LOCK:
+        if _WS_POOL is None:
+            _WS_POOL = WSPool([_start_ws_client(generate_client_id()) for _ in range(WS_POOL_SIZE)])
+        return _WS_POOL
+
+def acquire_ws_client() -> ComfyWSClient:
+    """
+    Выдаёт клиента из пула по кругу. Его client_id нужно передать в queue_prompt(),
+    чтобы события генерации пришли в это соединение.
+    """
+    return start_ws_pool().acquire()
+
+@lru_cache(maxsize=32)
+def _load_workflow_cached(workflow_name: str, mtime_ns: int) -> dict:
+    # mtime_ns входит в ключ кэша: изменённый на диске воркфлоу перечитывается
+    workflow_path = WORKFLOW_PATH / f"{workflow_name}.json"
+    return orjson.loads(workflow_path.read_bytes())
+
 def load_and_patch_workflow(workflow_name: str, node_overrides: dict) -> dict:
     workflow_path = WORKFLOW_PATH / f"{workflow_name}.json"
-    with open(workflow_path, "r", encoding="utf-8") as f:
-        workflow = json.load(f)
+    base = _load_workflow_cached(workflow_name, workflow_path.stat().st_mtime_ns)
+
+    # Закэшированный воркфлоу не изменяем: новые словари создаются
+    # только для переопределённых нод, остальные ноды разделяются со шаблоном
+    return {
+        node_id: node if node_id not in node_overrides else {
+            **node,
+            "inputs": {**node["inputs"], **node_overrides[node_id]},
+        }
+        for node_id, node in base.items()
+    }
 
-    for node_id, inputs in node_overrides.items():
-        if node_id in workflow:
-            workflow[node_id]["inputs"].update(inputs)
-    return workflow
+def view_url(filename: str, subfolder: str = "") -> str:
+    """URL выходного изображения ComfyUI; имя и поддиректория экранируются (пробелы, '&', юникод, '\\')."""
+    return f"{_VIEW_BASE}?{urlencode({'filename': filename, 'subfolder': subfolder})}"
 
 def queue_prompt(workflow_dict: dict, client_id: str) -> str:
-    response = requests.post(
+    response = _SESSION.post(
         f"{COMFY_API_URL}/prompt",
-        json={"prompt": workflow_dict, "client_id": client_id}
+        json={"prompt": workflow_dict, "client_id": client_id},
+        timeout=HTTP_TIMEOUT
     )
     response.raise_for_status()
     return response.json().get("prompt_id")
 
 def interrupt():
     try:
-        response = requests.post(f"{COMFY_API_URL}/interrupt")
+        response = _SESSION.post(f"{COMFY_API_URL}/interrupt", timeout=HTTP_TIMEOUT)
         return response.status_code == 200
     except Exception as e:
         print(f"[Interrupt] Ошибка при прерывании: {e}")
         return False
 
+def delete_queued(prompt_ids: list[str]) -> bool:
+    """Убирает из очереди ComfyUI ещё не начатые запросы (например, оставшиеся плитки после прерывания)."""
+    try:
+        response = _SESSION.post(f"{COMFY_API_URL}/queue", json={"delete": list(prompt_ids)}, timeout=HTTP_TIMEOUT)
+        return response.status_code == 200
+    except Exception as e:
+        print(f"[Queue] Ошибка при очистке очереди: {e}")
+        return False
+
 def get_node_outputs_from_history(prompt_id: str, node_ids: list[str]) -> dict[str, list[dict]]:
     """
     Получает все выходные данные указанных нод из истории выполнения запроса в ComfyUI.
@@ -118,7 +204,7 @@ def get_node_outputs_from_history(prompt_id: str, node_ids: list[str]) -> dict[s
     """
 
     try:
-        response = requests.get(f"{COMFY_API_URL}/history/{prompt_id}")
+        response = _SESSION.get(f"{COMFY_API_URL}/history/{prompt_id}", timeout=HTTP_TIMEOUT)
         if response.status_code != 200:
             return {}
 
@@ -141,6 +227,18 @@ def get_node_outputs_from_history(prompt_id: str, node_ids: list[str]) -> dict[s
         print(f"[History] ⚠ Ошибка при получении истории: {e}")
         return {}
 
+def wait_for_history(prompt_id: str, node_ids: list[str], delays: tuple = HISTORY_RETRY_DELAYS) -> dict[str, list[dict]]:
+    """
+    Запрашивает историю с нарастающими паузами и возвращает выходы нод, как только они появятся.
+    Если за все попытки их нет -- возвращает пустой словарь.
+    """
+    for delay in delays:
+        time.sleep(delay)
+        result = get_node_outputs_from_history(prompt_id, node_ids)
+        if result:
+            return result
+    return {}
+
 def monitor_websocket_for_node_output(client_id: str, expected_prompt_id: str, watch_node_ids: list[str], timeout: int = 15) -> dict[str, list[dict]]:
     """
     Слушает WebSocket от ComfyUI и извлекает выходы из указанных нод по завершении генерации.
@@ -171,45 +269,15 @@ def monitor_websocket_for_node_output(client_id: str, expected_prompt_id: str, w
     dict[str, list[dict]]
         Словарь с результатами по нодам
     """
-    result: dict[str, list[dict]] = {}
-    event = threading.Event()
-
-    def on_message(ws, message):
-        try:
-            data = json.loads(message)
-
-            if DEBUG and data.get("type") != "crystools.monitor":
-                print(f"[WS] 📩 {data}")
-
-            if data.get("type") == "executed":
-                d = data.get("data", {})
-                if d.get("prompt_id") != expected_prompt_id:
-                    return
-                node_id = d.get("node")
-                if node_id in watch_node_ids:
-                    output_data = d.get("output", {})
-                    result[node_id] = []
-                    for key, value in output_data.items():
-                        if isinstance(value, list):
-                            result[node_id].extend(value)
-                    event.set()
-                    ws.close()
-        except Exception as e:
-            print(f"[WS] ⚠ Ошибка: {e}")
-
-    ws_url = COMFY_API_URL.replace("http", "ws") + f"/ws?clientId={client_id}"
-    ws = websocket.WebSocketApp(ws_url, on_message=on_message)
-
-    thread = threading.Thread(target=ws.run_forever)
-    thread.daemon = True
-    thread.start()
-
-    success = event.wait(timeout)
-
-    if ws.sock and ws.sock.connected:
-        ws.close()
-
-    return result if success else {}
+    watch = get_ws_client(client_id).wait(expected_prompt_id, watch_node_ids, timeout)
+    if not watch.event.is_set():
+        return {}
+
+    # Склеиваем все списковые выходы ноды (images, text, ...) в один список
+    return {
+        node_id: [v for value in output_data.values() if isinstance(value, list) for v in value]
+        for node_id, output_data in watch.outputs.items()
+    }
 
 # core/comfy_api.py (дополнение к существующему коду)
 
@@ -224,139 +292,28 @@ def monitor_until_nodes_ready(
 ) -> dict[str, list[dict]]:
     """
     Ожидает, пока указанные ноды появятся в истории выполнения ComfyUI.
-    Закрывает WebSocket при достижении результата или по таймауту.
 
     Использует стратегию:
-    - Слушает WebSocket события (в фоне)
-    - Периодически запрашивает историю выполнения
-    - Как только все ноды есть в истории -- завершает
+    - Ждёт события по общему WebSocket-соединению клиента (см. ComfyWSClient)
+    - Берёт выходы нод прямо из событий `executed`
+    - Историю выполнения запрашивает только для нод, которых нет в событиях (кэш, таймаут)
     """
-    result: dict[str, list[dict]] = {}
-    event = threading.Event()
-    received_executed = set()
-
-    def request_interrupt():
-        try:
-            url = COMFY_API_URL + "/interrupt"
-            response = requests.post(url)
-            if DEBUG:
-                print(f"[INTERRUPT] Запрос отправлен: {response.status_code}")
-        except Exception as e:
-            print(f"[INTERRUPT] ⚠ Ошибка при прерывании: {e}")
-
-    def on_message(ws, message):
-        nonlocal received_executed
-        try:
-            # Проверяем, является ли сообщение бинарным (превью)
-            if isinstance(message, bytes):
-                if preview_callback and callable(preview_callback):
-                    try:
-                        # Важно! Пропускаем первые 8 байт, которые являются заголовком
-                        preview_data = message[8:]
-                        
-                        if DEBUG:
-                            print(f"[WS] Получены бинарные данные (превью), размер: {len(message)} байт, обрабатываем {len(preview_data)} байт после пропуска заголовка")
-                        
-                        preview_callback(preview_data)
-                    except Exception as e:
-                        if DEBUG:
-                            print(f"[WS] ⚠ Ошибка при обработке бинарных данных как превью: {e}")
-                return
-            
-            # Если не бинарные данные, пробуем декодировать как JSON
-            data = json.loads(message)
-
-            if DEBUG and data.get("type") != "crystools.monitor":
-                print(f"[WS] 📩 {data}")
-
-            if data.get("type") == "executed":
-                d = data.get("data", {})
-                if d.get("prompt_id") == prompt_id and d.get("node") in watch_node_ids:
-                    received_executed.add(d.get("node"))
-                    if DEBUG:
-                        print(f"[WS] ✅ Получено executed для ноды {d.get('node')}")
-                    if all(n in received_executed for n in watch_node_ids):
-                        if interrupt_on_ready:
-                            request_interrupt()
-                        event.set()
-                        ws.close()
-
-            elif data.get("type") == "execution_cached":
-                d = data.get("data", {})
-                if d.get("prompt_id") == prompt_id:
-                    cached_nodes = d.get("nodes", [])
-                    if all(n in cached_nodes for n in watch_node_ids):
-                        if DEBUG:
-                            print("[WS] 💾 Все нужные ноды закэшированы, завершаем.")
-                        if interrupt_on_ready:
-                            request_interrupt()
-                        event.set()
-                        ws.close()
-                    else:
-                        if DEBUG:
-                            print("[WS] ⏳ Частично закэшировано -- продолжаем ожидание.")
-
-            elif data.get("type") == "status":
-                d = data.get("data", {})
-                exec_info = d.get("status", {}).get("exec_info", {})
-                if exec_info.get("queue_remaining") == 0:
-                    if DEBUG:
-                        print("[WS] ⏹ Очередь пуста, можно завершать.")
-                    event.set()
-                    ws.close()
-
-            # Обработка специальных сообщений превью в JSON формате
-            elif data.get("type") == "preview":
-                if preview_callback and callable(preview_callback):
-                    try:
-                        preview_data = data.get("data", {}).get("image")
-                        if preview_data:
-                            import base64
-                            # Конвертируем base64 в бинарные данные
-                            binary_data = base64.b64decode(preview_data)
-                            preview_callback(binary_data)
-                            if DEBUG:
-                                print(f"[WS] Получено JSON превью, размер: {len(binary_data)} байт")
-                    except Exception as e:
-                        if DEBUG:
-                            print(f"[WS] ⚠ Ошибка при обработке JSON превью: {e}")
-
-        except Exception as e:
-            print(f"[WS] ⚠ Ошибка: {e}")
-
-    # Запуск WebSocket
-    ws_url = COMFY_API_URL.replace("http", "ws") + f"/ws?clientId={client_id}"
-    ws = websocket.WebSocketApp(
-        ws_url, 
-        on_message=on_message,
-        on_error=lambda ws, error: print(f"[WS] ⚠ Ошибка соединения: {error}"),
-        on_close=lambda ws, code, reason: print("[WS] Соединение закрыто")
+    watch = get_ws_client(client_id).wait(
+        prompt_id, watch_node_ids, timeout, preview_callback=preview_callback
     )
 
-    # Указываем параметр для получения бинарных данных
-    def on_open(ws):
+    if watch.ready and interrupt_on_ready:
+        success = interrupt()
         if DEBUG:
-            print("[WS] Соединение открыто, запрашиваем бинарные превью")
-        # Отправляем запрос на получение превью в различных форматах для поддержки разных версий ComfyUI
-        ws.send(json.dumps({"type": "subscribe", "data": {"channel": "preview"}}))
-        ws.send(json.dumps({"type": "binary_preview"}))
+            print(f"[INTERRUPT] Запрос отправлен: {'успешно' if success else 'ошибка'}")
 
-    ws.on_open = on_open
+    result: dict[str, list[dict]] = dict(watch.outputs)
 
-    thread = threading.Thread(target=ws.run_forever, kwargs={"ping_interval": 5})
-    thread.daemon = True
-    thread.start()
-
-    # Основной цикл ожидания (WebSocket или таймаут)
-    start_time = time.time()
-    success = event.wait(timeout)
-
-    if ws.sock and ws.sock.connected:
-        ws.close()
-
-    # После того как generation завершена -- пробуем получить историю
-    if DEBUG:
-        print("[INFO] Запрашиваем историю после завершения...")
+    # Закэшированные ноды не присылают executed -- их выходы есть только в истории
+    missing = [n for n in watch_node_ids if n not in result]
+    if missing:
+        if DEBUG:
+            print(f"[INFO] Запрашиваем историю для нод {missing}...")
+        result.update(get_node_outputs_from_history(prompt_id, missing))
 
-    result = get_node_outputs_from_history(prompt_id, watch_node_ids)
-    return result if result else {}
\ No newline at end of file
+    return result
@@ -1,12 +1,21 @@
 # core/image_utils.py
 import io
+import os
 import uuid
-import requests
-from typing import Tuple, Optional, Union, Dict, List
+import shutil
+from typing import Tuple, Optional, Union, Dict, List, Iterator
 from pathlib import Path
+import numpy as np
 from PIL import Image, ImageOps
 
-from core.settings import DEBUG, COMFY_INPUT_PATH, COMFY_OUTPUT_PATH, COMFY_API_URL
+from core.settings import DEBUG, DEBUG_PATH, TEMP_PATH, COMFY_INPUT_PATH, COMFY_OUTPUT_PATH, COMFY_API_URL
+from core.comfy_api import get_session, view_url, HTTP_TIMEOUT
+
+# Размер куска при потоковом скачивании результата
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Путь к выходам ComfyUI строкой -- для поиска альтернативных путей в find_output_image
+_OUTPUT_PATH_STR = str(COMFY_OUTPUT_PATH)
 
 def save_image_locally(image: Image.Image, prefix: str) -> str:
     """
@@ -21,13 +30,14 @@ def save_image_locally(image: Image.Image, prefix: str) -> str:
     """
     filename = f"{prefix}_{uuid.uuid4()}.png"
     relative_path = Path("NESUPixel") / filename
-    abs_path = COMFY_INPUT_PATH / filename
-    
-    # Убедимся, что директория существует
-    abs_path.parent.mkdir(exist_ok=True, parents=True)
+    abs_path = COMFY_INPUT_PATH / filename  # директория создаётся при загрузке settings
     
-    # Сохраняем как PNG, явно указываем формат
-    image.save(abs_path, format="PNG")
+    # Сохраняем как PNG с минимальным сжатием: файл читается ComfyUI один раз,
+    # а zlib по умолчанию (уровень 6) заметно дольше кодирует большие изображения.
+    # Пишем во временный файл и переименовываем, чтобы ComfyUI не прочитал PNG наполовину
+    tmp_path = abs_path.with_suffix(".png.tmp")
+    image.save(tmp_path, format="PNG", compress_level=1, optimize=False)
+    os.replace(tmp_path, abs_path)
     
     if DEBUG:
         print(f"[SAVE] Изображение сохранено: {abs_path}")
@@ -35,24 +45,65 @@ def save_image_locally(image: Image.Image, prefix: str) -> str:
     # Возвращаем относительный путь в формате, совместимом с ComfyUI
     return str(relative_path).replace("\\", "/")
 
-def save_debug_image(image: Image.Image, prefix: str) -> Path:
+def upload_image(image: Image.Image, prefix: str) -> str:
     """
-    Сохраняет изображение для отладки в директории debug.
+    Загружает изображение в ComfyUI через /upload/image и возвращает относительный путь.
+    Файл передаётся из памяти, без записи в общую директорию ввода.
+    Если загрузка не удалась, сохраняет изображение локально (save_image_locally).
     
     Args:
-        image: Изображение PIL для сохранения
+        image: Изображение PIL для загрузки
         prefix: Префикс имени файла
         
     Returns:
-        Путь к сохраненному файлу
+        Относительный путь в формате, понятном для ComfyUI
     """
-    debug_dir = Path("debug")
-    debug_dir.mkdir(exist_ok=True)
-    debug_path = debug_dir / f"{prefix}_{uuid.uuid4()}.png"
-    image.save(debug_path, format="PNG")
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", compress_level=1, optimize=False)
+    buf.seek(0)
+    
+    try:
+        response = get_session().post(
+            f"{COMFY_API_URL}/upload/image",
+            files={"image": (f"{prefix}_{uuid.uuid4()}.png", buf, "image/png")},
+            data={"subfolder": "NESUPixel", "overwrite": "true"},
+            timeout=HTTP_TIMEOUT,
+        )
+        response.raise_for_status()
+        info = response.json()
+    except Exception as e:
+        print(f"[UPLOAD] ⚠ Ошибка загрузки в ComfyUI, сохраняем локально: {e}")
+        return save_image_locally(image, prefix)
+    
+    # Сервер сам сообщает итоговое имя (оно может отличаться при совпадении)
+    subfolder = info.get("subfolder", "")
+    relative_path = f"{subfolder}/{info['name']}" if subfolder else info["name"]
     
     if DEBUG:
-        print(f"[DEBUG] Изображение сохранено: {debug_path}")
+        print(f"[UPLOAD] Изображение загружено: {relative_path}")
+    
+    return relative_path
+
+def save_debug_image(image: Image.Image, prefix: str) -> Optional[Path]:
+    """
+    Сохраняет изображение для отладки в директории debug (только в режиме DEBUG).
+    Имя файла постоянное (last_<prefix>.png): каждый вызов перезаписывает предыдущий снимок,
+    поэтому директория не растёт от генерации к генерации.
+    
+    Args:
+        image: Изображение PIL для сохранения
+        prefix: Префикс имени файла
+        
+    Returns:
+        Путь к сохраненному файлу или None, если DEBUG выключен
+    """
+    if not DEBUG:
+        return None
+    
+    debug_path = DEBUG_PATH / f"last_{prefix}.png"
+    image.save(debug_path, format="PNG", compress_level=1, optimize=False)
+    
+    print(f"[DEBUG] Изображение сохранено: {debug_path}")
         
     return debug_path
 
@@ -84,33 +135,35 @@ def process_editor_output(editor_output: dict, invert_mask: bool = False) -> Tup
         
         # В слое RGBA, альфа канал содержит непрозрачность рисования
         if mask_layer.mode == 'RGBA':
-            # Извлекаем альфа-канал (это будет наша маска)
-            r, g, b, alpha = mask_layer.split()
-            
+            # Извлекаем только альфа-канал (это будет наша маска), без split() на четыре канала
             # Alpha канал: 0=прозрачно, 255=непрозрачно
-            mask = alpha
+            alpha = mask_layer.getchannel("A")
+            alpha_min, alpha_max = alpha.getextrema()
             
-            # Применяем инверсию при необходимости
-            if invert_mask:
-                mask = ImageOps.invert(mask)
+            if alpha_min == alpha_max:
+                # Однородная маска (ничего не нарисовано или закрашено всё) -- без попиксельной обработки
+                mask = Image.new("L", alpha.size, 255 - alpha_min if invert_mask else alpha_min)
+            elif invert_mask:
+                # Применяем инверсию при необходимости
+                mask = ImageOps.invert(alpha)
+            else:
+                mask = alpha
         else:
             # Для других режимов
-            mask_layer = mask_layer.convert("L")
+            mask_l = mask_layer.convert("L")
             
-            # Анализируем яркость маски
-            avg_brightness = sum(mask_layer.getdata()) / (mask_layer.width * mask_layer.height)
+            # Анализируем яркость маски. Для решения «светлая или тёмная» хватает уменьшенной
+            # в 8 раз копии (reduce усредняет блоки 8x8) -- в 64 раза меньше пикселей
+            sample = mask_l.reduce(8) if max(mask_l.size) > 256 else mask_l
+            avg_brightness = float(np.asarray(sample).mean())
             
             if DEBUG:
                 print(f"[EDITOR] Средняя яркость маски: {avg_brightness}")
             
-            # Если маска светлая, пользователь рисовал темным
-            if avg_brightness > 128:
-                mask = ImageOps.invert(mask_layer)
-            else:
-                mask = mask_layer
-            
-            if invert_mask:
-                mask = ImageOps.invert(mask)
+            # Если маска светлая, пользователь рисовал темным -- инвертируем.
+            # Вместе с пожеланием пользователя это одна инверсия по XOR, а не две подряд
+            need_invert = (avg_brightness > 128) != invert_mask
+            mask = ImageOps.invert(mask_l) if need_invert else mask_l
     else:
         # Если слоев нет, создаем пустую маску
         if DEBUG:
@@ -124,6 +177,81 @@ def process_editor_output(editor_output: dict, invert_mask: bool = False) -> Tup
         
     return base_image, mask
 
+# Минимальный вес окна смешивания: окно Ханна равно нулю на краях плитки,
+# а у края изображения других плиток нет
+TILE_WEIGHT_EPS = 1e-3
+
+def tile_boxes(width: int, height: int, tile: int, overlap: int) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Разбивает изображение на плитки с перекрытием.
+    
+    Args:
+        width, height: Размер изображения
+        tile: Размер плитки
+        overlap: Перекрытие соседних плиток
+        
+    Returns:
+        Итератор коробок (left, top, right, bottom) для Image.crop;
+        последняя плитка в ряду прижата к краю изображения
+    """
+    step = max(tile - overlap, 1)
+    
+    def starts(size: int) -> List[int]:
+        if size <= tile:
+            return [0]
+        positions = list(range(0, size - tile, step))
+        positions.append(size - tile)
+        return positions
+    
+    for top in starts(height):
+        for left in starts(width):
+            yield left, top, min(left + tile, width), min(top + tile, height)
+
+def blend_tiles(base_image: Image.Image, tiles: List[Tuple[Tuple[int, int, int, int], Image.Image]]) -> Image.Image:
+    """
+    Собирает обработанные плитки обратно в изображение с плавным смешиванием в зонах перекрытия.
+    
+    Args:
+        base_image: Исходное изображение (остаётся там, где плиток нет)
+        tiles: Список (коробка, обработанная плитка)
+        
+    Returns:
+        Итоговое изображение RGB
+    """
+    base = np.asarray(base_image.convert("RGB"), dtype=np.float32)
+    acc = np.zeros_like(base)
+    weight_sum = np.zeros(base.shape[:2], dtype=np.float32)
+    
+    for (left, top, right, bottom), tile_image in tiles:
+        h, w = bottom - top, right - left
+        if tile_image.size != (w, h):
+            tile_image = tile_image.resize((w, h), Image.LANCZOS)
+        tile_arr = np.asarray(tile_image.convert("RGB"), dtype=np.float32)
+        
+        # Окно Ханна: вес падает к краям плитки, поэтому швы между плитками не видны
+        weight = np.maximum(np.outer(np.hanning(h), np.hanning(w)), TILE_WEIGHT_EPS).astype(np.float32)
+        acc[top:bottom, left:right] += tile_arr * weight[..., None]
+        weight_sum[top:bottom, left:right] += weight
+    
+    covered = weight_sum > 0
+    result = base
+    result[covered] = acc[covered] / weight_sum[covered][:, None]
+    
+    return Image.fromarray(np.clip(result + 0.5, 0, 255).astype(np.uint8))
+
+# Порог бинаризации маски -- тот же, что у ноды ToBinaryMask в воркфлоу inpaint (0..255).
+# ToBinaryMask оставляет только значения строго больше порога, поэтому сравнение строгое
+MASK_BINARY_THRESHOLD = 20
+_MASK_BINARY_LUT = [255 if v > MASK_BINARY_THRESHOLD else 0 for v in range(256)]
+
+def binarize_mask(mask: Image.Image) -> Image.Image:
+    """
+    Переводит маску в режим "1" (1 бит на пиксель) по порогу MASK_BINARY_THRESHOLD.
+    Воркфлоу всё равно бинаризует маску с тем же порогом, а PNG такой маски
+    кодируется и передаётся в разы быстрее 8-битной.
+    """
+    return mask.convert("L").point(_MASK_BINARY_LUT, "1")
+
 def find_output_image(filename: str, subfolder: str) -> Optional[Path]:
     """
     Находит выходное изображение по возможным путям.
@@ -135,16 +263,17 @@ def find_output_image(filename: str, subfolder: str) -> Optional[Path]:
     Returns:
         Путь к найденному файлу или None
     """
-    # Пробуем различные варианты путей
-    possible_paths = []
+    # Быстрый путь: основной путь -- один stat без построения списка
+    direct = COMFY_OUTPUT_PATH / subfolder / filename
+    if direct.is_file():
+        return direct
     
-    # Основной путь
-    path_str = str(COMFY_OUTPUT_PATH)
-    possible_paths.append(Path(path_str) / subfolder / filename)
+    # Пробуем остальные варианты путей
+    possible_paths = []
     
     # Путь без дублирования NESUPixel
-    if "NESUPixel" in path_str:
-        alt_path_str = path_str.replace("NESUPixel", "", 1)
+    if "NESUPixel" in _OUTPUT_PATH_STR:
+        alt_path_str = _OUTPUT_PATH_STR.replace("NESUPixel", "", 1)
         possible_paths.append(Path(alt_path_str) / subfolder / filename)
     
     # Третий вариант пути
@@ -154,23 +283,24 @@ def find_output_image(filename: str, subfolder: str) -> Optional[Path]:
     possible_paths.append(Path("output") / subfolder / filename)
     
     if DEBUG:
-        print(f"[FIND] Проверяем пути: {possible_paths}")
+        print(f"[FIND] Проверяем пути: {[direct] + possible_paths}")
     
     # Пробуем все пути
     for path in possible_paths:
-        if path.exists():
+        if path.is_file():
             if DEBUG:
                 print(f"[FIND] Файл найден: {path}")
             return path
     
     return None
 
-def download_image(url: str) -> Optional[Path]:
+def download_image(url: str, filename: Optional[str] = None) -> Optional[Path]:
     """
     Скачивает изображение по URL и сохраняет во временной директории.
     
     Args:
         url: URL изображения
+        filename: Имя файла в temp (по умолчанию -- уникальное download_<uuid>.png)
         
     Returns:
         Путь к скачанному файлу или None
@@ -179,26 +309,62 @@ def download_image(url: str) -> Optional[Path]:
         if DEBUG:
             print(f"[DOWNLOAD] Скачивание: {url}")
         
-        response = requests.get(url)
-        if response.status_code == 200:
-            temp_dir = Path("temp")
-            temp_dir.mkdir(exist_ok=True)
-            filename = f"download_{uuid.uuid4()}.png"
-            temp_file = temp_dir / filename
+        # Пишем тело ответа на диск кусками, не собирая всю картинку в памяти
+        with get_session().get(url, stream=True, timeout=(HTTP_TIMEOUT[0], 60)) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
             
-            with open(temp_file, "wb") as f:
-                f.write(response.content)
+            temp_file = TEMP_PATH / (filename or f"download_{uuid.uuid4()}.png")
             
-            if DEBUG:
-                print(f"[DOWNLOAD] Сохранено: {temp_file}")
+            with open(temp_file, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=DOWNLOAD_CHUNK_SIZE)
             
-            return temp_file
+        if DEBUG:
+            print(f"[DOWNLOAD] Сохранено: {temp_file}")
+        
+        return temp_file
     except Exception as e:
         if DEBUG:
             print(f"[DOWNLOAD] Ошибка: {e}")
     
     return None
 
+def fetch_image(url: str, filename: Optional[str] = None) -> Tuple[Optional[Image.Image], Optional[Path]]:
+    """
+    Скачивает изображение один раз: декодирует его из тех же байт, что пишет на диск,
+    без повторного чтения сохранённого файла.
+    
+    Args:
+        url: URL изображения
+        filename: Имя файла в temp (по умолчанию -- уникальное download_<uuid>.png)
+        
+    Returns:
+        Кортеж (изображение, путь_к_файлу) или (None, None)
+    """
+    try:
+        if DEBUG:
+            print(f"[DOWNLOAD] Скачивание с декодированием: {url}")
+        
+        response = get_session().get(url, timeout=(HTTP_TIMEOUT[0], 60))
+        response.raise_for_status()
+        data = response.content
+        
+        image = Image.open(io.BytesIO(data))
+        image.load()  # декодируем сразу, пока байты под рукой
+        
+        temp_file = TEMP_PATH / (filename or f"download_{uuid.uuid4()}.png")
+        temp_file.write_bytes(data)
+        
+        if DEBUG:
+            print(f"[DOWNLOAD] Сохранено: {temp_file}, размер: {image.size}")
+        
+        return image, temp_file
+    except Exception as e:
+        if DEBUG:
+            print(f"[DOWNLOAD] Ошибка: {e}")
+    
+    return None, None
+
 def get_output_image_info(result: Dict, node_id: str) -> Tuple[Optional[str], Optional[Path]]:
     """
     Извлекает информацию о выходном изображении из результата ComfyUI.
@@ -216,7 +382,7 @@ def get_output_image_info(result: Dict, node_id: str) -> Tuple[Optional[str], Op
             file_info = images[0]
             filename = file_info['filename']
             subfolder = file_info.get('subfolder', '')
-            url = f"{COMFY_API_URL}/view?filename={filename}&subfolder={subfolder}"
+            url = view_url(filename, subfolder)
             
             # Пробуем найти файл
             file_path = find_output_image(filename, subfolder)
@@ -1,4 +1,5 @@
-import json
+import orjson
+import gradio as gr
 from pathlib import Path
 
 from core.settings import BASE_DIR
@@ -11,8 +12,27 @@ def load_lora_presets() -> list[dict]:
     Каждый пресет содержит: alias, filename, recommended_strength, keywords.
     """
     try:
-        with open(LORA_PRESET_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return orjson.loads(LORA_PRESET_PATH.read_bytes())
     except Exception as e:
         print(f"[LoRA] ⚠ Не удалось загрузить пресеты: {e}")
         return []
+
+# Входы LoraLoader при выключенной LoRA. Общий неизменяемый шаблон:
+# load_and_patch_workflow только читает переопределения и не изменяет их
+LORA_OFF = {"strength_model": 0.0, "strength_clip": 0.0}
+
+def lora_inputs(lora_name: str, lora_strength: float) -> dict:
+    """Переопределение входов ноды LoraLoader: выбранная LoRA или нулевая сила, если LoRA не задана."""
+    if not lora_name:
+        return LORA_OFF
+    return {"lora_name": lora_name, "strength_model": lora_strength, "strength_clip": lora_strength}
+
+# Пресеты загружаются один раз и общие для всех вкладок
+LORA_PRESETS = load_lora_presets()
+# Варианты выпадающего списка и готовые ответы apply_lora_preset: alias -> (файл, рекомендуемая сила)
+LORA_ALIASES = tuple(p["alias"] for p in LORA_PRESETS)
+LORA_ALIAS_OUTPUTS = {p["alias"]: (p["filename"], p.get("recommended_strength", 0.7)) for p in LORA_PRESETS}
+
+def apply_lora_preset(alias: str):
+    """Обработчик выбора стиля: (файл LoRA, рекомендуемая сила) или «без изменений» для неизвестного alias."""
+    return LORA_ALIAS_OUTPUTS.get(alias) or (gr.update(), gr.update())
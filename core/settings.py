@@ -7,10 +7,16 @@ COMFY_BASE_PATH = Path("E:/AISoftware/ComfyUI/ComfyUI")
 WORKFLOW_PATH = Path(__file__).parent.parent / "workflows"
 COMFY_OUTPUT_PATH = COMFY_BASE_PATH / "output" / "NESUPixel"
 COMFY_INPUT_PATH = COMFY_BASE_PATH / "input" / "NESUPixel"
+DEBUG_PATH = Path("debug")
+TEMP_PATH = Path("temp")  # скачанные и собранные результаты
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 # === Сеть ===
 COMFY_API_URL = "http://127.0.0.1:8188"
+# http → ws, https → wss (заменяем только схему, а не вхождения в пути)
+WS_BASE_URL = COMFY_API_URL.replace("http", "ws", 1)
+# Сколько WebSocket-соединений с ComfyUI держим открытыми заранее
+WS_POOL_SIZE = 2
 GRADIO_HOST = "127.0.0.1"
 GRADIO_PORT = 7860
 
@@ -19,6 +25,15 @@ DEFAULT_WIDTH = 1024
 DEFAULT_HEIGHT = 1024
 DEFAULT_NEGATIVE_PROMPT = "blurry, bad anatomy, low quality"
 DEFAULT_SEED = 0
+# Предельное время одной генерации (секунды): по истечении задача в ComfyUI прерывается
+GENERATION_TIMEOUT = 300
+
+# === Inpaint больших изображений ===
+# Изображения больше порога (по длинной стороне) обрабатываются плитками с перекрытием
+INPAINT_TILE_THRESHOLD = 2048
+# Размер плитки и перекрытие (1/3 плитки); 1536 = 3 * 2^9
+INPAINT_TILE_SIZE = 1536
+INPAINT_TILE_OVERLAP = 512
 
 # === Переводчики ===
 # Переводчик: "argos", "deep", "none"
@@ -27,3 +42,11 @@ TRANSLATOR = "deep"
 SOURCE_LANG = "ru"
 TARGET_LANG = "en"
 
+# === Рабочие директории ===
+# Создаём один раз при запуске, чтобы не проверять их на каждом сохранении
+try:
+    COMFY_INPUT_PATH.mkdir(exist_ok=True, parents=True)
+except OSError as e:
+    print(f"[Settings] ⚠ Не удалось создать {COMFY_INPUT_PATH}: {e}")
+DEBUG_PATH.mkdir(exist_ok=True)
+TEMP_PATH.mkdir(exist_ok=True)
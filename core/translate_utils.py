@@ -1,22 +1,96 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 from core.settings import TRANSLATOR, SOURCE_LANG, TARGET_LANG
 
+# Импортируем только выбранный бэкенд и один раз -- при загрузке модуля, а не на каждый перевод
+_GoogleTranslator = None
+_argos = None
+try:
+    if TRANSLATOR == "deep":
+        from deep_translator import GoogleTranslator as _GoogleTranslator
+    elif TRANSLATOR == "argos":
+        from argostranslate import translate as _argos
+except ImportError as e:
+    print(f"[Переводчик] ⚠ Не удалось загрузить {TRANSLATOR}: {e}")
+
+# Через сколько секунд после последнего изменения промпта переводим его заранее
+PREWARM_DELAY = 0.3
+
+# Позитивный и негативный промпт переводятся параллельно -- это сетевое ожидание, а не CPU
+_TR_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="translate")
+_PREWARM_TIMERS: dict[str, threading.Timer] = {}
+_PREWARM_LOCK = threading.Lock()
+
+# Объекты-переводчики по паре языков: создаются один раз на поток и переиспользуются.
+# Свои для каждого потока, т.к. GoogleTranslator хранит параметры запроса в самом объекте;
+# переводы выполняются в постоянных потоках _TR_POOL, поэтому объектов не больше двух на пару
+_local = threading.local()
+
+def _get_translator(source_lang: str, target_lang: str):
+    translators = getattr(_local, "translators", None)
+    if translators is None:
+        translators = _local.translators = {}
+    key = (source_lang, target_lang)
+    translator = translators.get(key)
+    if translator is None:
+        if TRANSLATOR == "argos":
+            if _argos is None:
+                raise RuntimeError("пакет argostranslate не установлен")
+            translator = _argos.get_translation_from_codes(source_lang, target_lang)
+            if translator is None:
+                raise RuntimeError(f"не установлена модель {source_lang} → {target_lang}")
+        else:
+            if _GoogleTranslator is None:
+                raise RuntimeError("пакет deep-translator не установлен")
+            translator = _GoogleTranslator(source=source_lang, target=target_lang)
+        translators[key] = translator
+    return translator
+
+@lru_cache(maxsize=1024)
+def _translate_cached(text: str, source_lang: str, target_lang: str) -> str:
+    # lru_cache не запоминает исключения, поэтому неудачный перевод повторится при следующем вызове
+    return _get_translator(source_lang, target_lang).translate(text)
+
 def translate_text(text: str, source_lang: str = SOURCE_LANG, target_lang: str = TARGET_LANG) -> str:
     if not text.strip() or TRANSLATOR == "none":
         return text
 
-    try:
-        if TRANSLATOR == "argos":
-            from argostranslate import translate as argos
-            return argos.translate(text, source_lang, target_lang)
-
-        elif TRANSLATOR == "deep":
-            from deep_translator import GoogleTranslator
-            return GoogleTranslator(source=source_lang, target=target_lang).translate(text)
+    if TRANSLATOR not in ("argos", "deep"):
+        print(f"[Переводчик] Неизвестный TRANSLATOR: {TRANSLATOR}")
+        return text
 
-        else:
-            print(f"[Переводчик] Неизвестный TRANSLATOR: {TRANSLATOR}")
-            return text
+    try:
+        return _translate_cached(text, source_lang, target_lang)
 
     except Exception as e:
         print(f"[Перевод] Ошибка ({TRANSLATOR}): {e}")
-        return text
\ No newline at end of file
+        return text
+
+def translate_pair(positive: str, negative: str, source_lang: str = SOURCE_LANG, target_lang: str = TARGET_LANG) -> tuple[str, str]:
+    """Переводит позитивный и негативный промпт одновременно; пустой негативный остаётся пустым."""
+    # Оба перевода идут в потоках _TR_POOL: там живут уже созданные переводчики (см. _get_translator),
+    # а вызывающие потоки (новые на каждую генерацию) своих не заводят
+    future_positive = _TR_POOL.submit(translate_text, positive, source_lang, target_lang)
+    if not negative:
+        return future_positive.result(), ""
+    future_negative = _TR_POOL.submit(translate_text, negative, source_lang, target_lang)
+    return future_positive.result(), future_negative.result()
+
+def prewarm_translation(text: str, key: str = "default") -> None:
+    """
+    Переводит текст в фоне через PREWARM_DELAY секунд, чтобы к нажатию «Сгенерировать»
+    перевод уже лежал в кэше. Новый вызов с тем же key отменяет ещё не начатый перевод.
+    """
+    if not text or not text.strip() or TRANSLATOR == "none":
+        return
+    # Таймер только ставит перевод в _TR_POOL, чтобы переиспользовать переводчики его потоков
+    timer = threading.Timer(PREWARM_DELAY, _TR_POOL.submit, args=(translate_text, text))
+    timer.daemon = True
+    with _PREWARM_LOCK:
+        previous = _PREWARM_TIMERS.get(key)
+        if previous:
+            previous.cancel()
+        _PREWARM_TIMERS[key] = timer
+    timer.start()
@@ -0,0 +1,312 @@
+# core/ws_client.py
+
+import base64
+import itertools
+import json
+import queue
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import orjson
+import websocket
+
+from core.settings import WS_BASE_URL, DEBUG
+
+# Пауза перед переподключением (секунды), удваивается при каждой неудаче
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+# Через сколько секунд тишины отправляем ping (и считаем соединение мёртвым, если нет ответа)
+PING_INTERVAL = 5.0
+# Сколько превью держим в очереди к обработчику; при переполнении отбрасываем самые старые
+PREVIEW_QUEUE_SIZE = 2
+# Начало сообщений мониторинга crystools (статистика GPU/CPU раз в секунду) -- они нам не нужны
+CRYSTOOLS_MONITOR_PREFIX = b'{"type": "crystools.monitor"'
+
+
+@dataclass
+class PromptWatch:
+    """Состояние ожидания одного prompt_id на общем WebSocket."""
+    watch_node_ids: frozenset                             # ноды, которые мы ждём
+    preview_callback: Optional[Callable[[bytes], None]] = None
+    executed: set = field(default_factory=set)            # ноды, для которых пришёл executed
+    outputs: dict = field(default_factory=dict)           # {node_id: output} из событий executed
+    ready: bool = False                                   # все ноды выполнены или взяты из кэша
+    event: threading.Event = field(default_factory=threading.Event)
+
+
+class ComfyWSClient:
+    """
+    Долгоживущее WebSocket-соединение с ComfyUI для одного client_id.
+
+    Соединение открывается один раз (при старте приложения), а ожидания отдельных
+    запросов мультиплексируются поверх него: каждое сообщение раскладывается
+    по зарегистрированным PromptWatch через `data["prompt_id"]`.
+    При обрыве соединение восстанавливается с экспоненциальной паузой.
+
+    Всё чтение идёт в одном потоке через блокирующий websocket.WebSocket
+    с таймаутом на сокете (без WebSocketApp и его цикла обратных вызовов).
+    """
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.ws_url = f"{WS_BASE_URL}/ws?clientId={client_id}"
+        self.ws: Optional[websocket.WebSocket] = None
+        self._pending: dict[str, PromptWatch] = {}
+        self._finished: deque[str] = deque(maxlen=64)
+        self._running_prompt_id: Optional[str] = None
+        self._binary_supported = False   # сервер уже присылал бинарные превью
+        self._lock = threading.Lock()
+        self._reconnect_now = threading.Event()
+        self._delay = RECONNECT_MIN_DELAY
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._preview_queue: queue.Queue = queue.Queue(maxsize=PREVIEW_QUEUE_SIZE)
+        self._preview_thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not (self._preview_thread and self._preview_thread.is_alive()):
+            self._preview_thread = threading.Thread(target=self._preview_worker, daemon=True)
+            self._preview_thread.start()
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._reconnect_now.set()
+        ws = self.ws
+        if ws:
+            ws.close()
+
+    @property
+    def connected(self) -> bool:
+        ws = self.ws
+        return bool(ws and ws.connected)
+
+    def wait(
+        self,
+        prompt_id: str,
+        watch_node_ids: list[str],
+        timeout: float,
+        preview_callback: Optional[Callable[[bytes], None]] = None,
+    ) -> PromptWatch:
+        """
+        Регистрирует ожидание prompt_id и блокируется, пока указанные ноды не будут
+        выполнены, запрос не завершится или не истечёт таймаут.
+
+        Возвращает PromptWatch: `event.is_set()` — дождались ли, `outputs` — выходы нод
+        из событий executed (в том же формате, что и в /history).
+        """
+        # frozenset: проверки в on_message -- O(1) вместо прохода по списку
+        watch = PromptWatch(frozenset(watch_node_ids), preview_callback)
+        with self._lock:
+            self._pending[prompt_id] = watch
+            # Запрос мог завершиться раньше, чем мы начали ждать
+            if prompt_id in self._finished:
+                watch.event.set()
+
+        if not self.connected:
+            # Не ждём окончания паузы переподключения
+            self._reconnect_now.set()
+
+        try:
+            watch.event.wait(timeout)
+        finally:
+            with self._lock:
+                self._pending.pop(prompt_id, None)
+        return watch
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                ws = websocket.create_connection(self.ws_url, timeout=PING_INTERVAL)
+            except Exception as e:
+                print(f"[WS] ⚠ Ошибка соединения: {e}")
+            else:
+                self.ws = ws
+                self._on_open(ws)
+                self._read_loop(ws)
+                self.ws = None
+                print("[WS] Соединение закрыто")
+
+            if self._stopped:
+                break
+            if DEBUG:
+                print(f"[WS] Переподключение через {self._delay:.0f} с")
+            self._reconnect_now.wait(self._delay)
+            self._reconnect_now.clear()
+            self._delay = min(self._delay * 2, RECONNECT_MAX_DELAY)
+
+    def _read_loop(self, ws: websocket.WebSocket):
+        awaiting_pong = False
+        try:
+            while not self._stopped:
+                try:
+                    opcode, message = ws.recv_data(control_frame=True)
+                except websocket.WebSocketTimeoutException:
+                    if awaiting_pong:
+                        print("[WS] ⚠ Сервер не отвечает на ping")
+                        return
+                    ws.ping()
+                    awaiting_pong = True
+                    continue
+
+                awaiting_pong = False
+                if opcode == websocket.ABNF.OPCODE_CLOSE:
+                    return
+                if opcode in (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY):
+                    self._on_message(opcode, message)
+        except (websocket.WebSocketException, OSError) as e:
+            if not self._stopped:
+                print(f"[WS] ⚠ Ошибка соединения: {e}")
+        finally:
+            ws.close()
+
+    def _on_open(self, ws: websocket.WebSocket):
+        self._delay = RECONNECT_MIN_DELAY
+        self._binary_supported = False
+        if DEBUG:
+            print("[WS] Соединение открыто, запрашиваем бинарные превью")
+        # Отправляем запрос на получение превью в различных форматах для поддержки разных версий ComfyUI
+        ws.send(json.dumps({"type": "subscribe", "data": {"channel": "preview"}}))
+        ws.send(json.dumps({"type": "binary_preview"}))
+
+    def _watch_for(self, prompt_id: Optional[str]) -> Optional[PromptWatch]:
+        with self._lock:
+            return self._pending.get(prompt_id)
+
+    def _on_preview(self, preview_data, encoded: bool = False):
+        # Превью не содержат prompt_id -- относим их к выполняющемуся запросу
+        watch = self._watch_for(self._running_prompt_id)
+        if not (watch and callable(watch.preview_callback)):
+            return
+
+        # Поток чтения WebSocket не должен ждать UI: кладём превью в очередь,
+        # вытесняя самое старое, если обработчик не успевает
+        item = (watch.preview_callback, preview_data, encoded)
+        while True:
+            try:
+                self._preview_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._preview_queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _preview_worker(self):
+        while True:
+            callback, preview_data, encoded = self._preview_queue.get()
+            try:
+                if encoded:
+                    # Конвертируем base64 в бинарные данные
+                    preview_data = base64.b64decode(preview_data)
+                callback(preview_data)
+            except Exception as e:
+                if DEBUG:
+                    print(f"[WS] ⚠ Ошибка при обработке превью: {e}")
+
+    def _on_message(self, opcode: int, message: bytes):
+        try:
+            # Бинарное сообщение -- превью
+            if opcode == websocket.ABNF.OPCODE_BINARY:
+                self._binary_supported = True
+                # Важно! Пропускаем первые 8 байт, которые являются заголовком
+                if DEBUG:
+                    print(f"[WS] Получены бинарные данные (превью), размер: {len(message)} байт")
+                self._on_preview(message[8:])
+                return
+
+            # Самый частый и всегда игнорируемый тип сообщений отбрасываем без разбора JSON
+            if message.startswith(CRYSTOOLS_MONITOR_PREFIX):
+                return
+
+            data = orjson.loads(message)
+            msg_type = data.get("type")
+
+            if DEBUG and msg_type != "crystools.monitor":
+                print(f"[WS] 📩 {data}")
+
+            d = data.get("data") or {}
+
+            if msg_type == "status":
+                exec_info = d.get("status", {}).get("exec_info", {})
+                if exec_info.get("queue_remaining") == 0:
+                    if DEBUG:
+                        print("[WS] ⏹ Очередь пуста, можно завершать.")
+                    with self._lock:
+                        watches = list(self._pending.values())
+                    for watch in watches:
+                        watch.event.set()
+                return
+
+            # Обработка специальных сообщений превью в JSON формате.
+            # Если сервер уже шлёт бинарные превью, JSON-копии тех же кадров не декодируем
+            if msg_type == "preview":
+                preview_data = d.get("image")
+                if preview_data and not self._binary_supported:
+                    self._on_preview(preview_data, encoded=True)
+                return
+
+            prompt_id = d.get("prompt_id")
+
+            if msg_type == "execution_start":
+                self._running_prompt_id = prompt_id
+                return
+
+            finished = msg_type in ("execution_success", "execution_error", "execution_interrupted") or (
+                msg_type == "executing" and d.get("node") is None
+            )
+            if finished and prompt_id:
+                with self._lock:
+                    self._finished.append(prompt_id)
+                    watch = self._pending.get(prompt_id)
+                if watch:
+                    watch.event.set()
+                return
+
+            watch = self._watch_for(prompt_id)
+            if watch is None:
+                return
+
+            if msg_type == "executed":
+                node_id = d.get("node")
+                if node_id in watch.watch_node_ids:
+                    watch.outputs[node_id] = d.get("output", {})
+                    watch.executed.add(node_id)
+                    if DEBUG:
+                        print(f"[WS] ✅ Получено executed для ноды {node_id}")
+                    if watch.watch_node_ids <= watch.executed:
+                        watch.ready = True
+                        watch.event.set()
+
+            elif msg_type == "execution_cached":
+                cached_nodes = d.get("nodes", [])
+                if watch.watch_node_ids.issubset(cached_nodes):
+                    if DEBUG:
+                        print("[WS] 💾 Все нужные ноды закэшированы, завершаем.")
+                    watch.ready = True
+                    watch.event.set()
+                elif DEBUG:
+                    print("[WS] ⏳ Частично закэшировано -- продолжаем ожидание.")
+
+        except Exception as e:
+            print(f"[WS] ⚠ Ошибка: {e}")
+
+
+class WSPool:
+    """
+    Фиксированный набор заранее открытых ComfyWSClient.
+    Клиенты выдаются по кругу, чтобы запросы, отправленные подряд, не делили одно соединение.
+    """
+
+    def __init__(self, clients: list[ComfyWSClient]):
+        self._clients = list(clients)
+        self._counter = itertools.count()
+
+    def acquire(self) -> ComfyWSClient:
+        return self._clients[next(self._counter) % len(self._clients)]
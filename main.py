@@ -3,9 +3,12 @@ import gradio as gr
 from modes.txt2img import create_txt2img_ui
 from modes.inpaint import create_inpaint_ui  # ✅ новый импорт
 from core.settings import GRADIO_HOST, GRADIO_PORT
+from core.comfy_api import start_ws_pool
 
 
 def build_interface():
+    # Открываем WebSocket-соединения к ComfyUI заранее, чтобы не платить за handshake при генерации
+    start_ws_pool()
     with gr.Blocks(title="NESUPixel") as app:
         gr.Markdown("# NESUPixel 📷 - Image Generation Platform")
         create_txt2img_ui()
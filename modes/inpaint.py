@@ -1,162 +1,62 @@
 # modes/inpaint.py
 import gradio as gr
 import uuid
-import time
 import io
+import queue
 import threading
-from PIL import Image, ImageOps
+import traceback
+from PIL import Image
 from pathlib import Path
-from core.comfy_api import generate_client_id, queue_prompt, load_and_patch_workflow, monitor_until_nodes_ready, interrupt
+from core.comfy_api import acquire_ws_client, queue_prompt, load_and_patch_workflow, monitor_until_nodes_ready, wait_for_history, interrupt, delete_queued, view_url
 from core.workflow_descriptor import WorkflowDescriptor
-from core.translate_utils import translate_text
-from core.settings import DEBUG, COMFY_API_URL, COMFY_OUTPUT_PATH, COMFY_INPUT_PATH, DEFAULT_SEED
-from core.lora_utils import load_lora_presets
+from core.translate_utils import translate_pair, prewarm_translation
+from core.settings import DEBUG, TEMP_PATH, DEFAULT_SEED, GENERATION_TIMEOUT, INPAINT_TILE_THRESHOLD, INPAINT_TILE_SIZE, INPAINT_TILE_OVERLAP
+from core.lora_utils import LORA_ALIASES, apply_lora_preset, lora_inputs
+from core.image_utils import process_editor_output, binarize_mask, upload_image, download_image, fetch_image, find_output_image, get_output_image_info, tile_boxes, blend_tiles
 
-LORA_PRESETS = load_lora_presets()
-LORA_ALIAS_MAP = {preset["alias"]: preset for preset in LORA_PRESETS}
+EMPTY_MASK_MESSAGE = "Пустая маска -- нечего заменять"
 
-def save_image_locally(image: Image.Image, prefix: str) -> str:
-    filename = f"{prefix}_{uuid.uuid4()}.png"
-    relative_path = Path("NESUPixel") / filename
-    abs_path = COMFY_INPUT_PATH / filename
-    
-    # Убедимся, что директория существует
-    abs_path.parent.mkdir(exist_ok=True, parents=True)
-    
-    # Сохраняем как PNG, явно указываем формат
-    image.save(abs_path, format="PNG")
-    
-    if DEBUG:
-        print(f"[SAVE] Изображение сохранено: {abs_path}")
-    
-    # Возвращаем относительный путь в формате, совместимом с ComfyUI
-    return str(relative_path).replace("\\", "/")
+
+class EmptyMaskError(Exception):
+    """Маска пустая -- генерацию не запускаем, а показываем пользователю сообщение."""
 
 def generate_inpaint(
     positive_ru, negative_ru,
     editor_output: dict,
-    _dup,
     invert_mask: bool,
     lora_name, lora_strength,
     seed, translate, use_prompt_assistant,
     preview_func=None
 ):
-    client_id = generate_client_id()
+    # События генерации приходят в заранее открытое WebSocket-соединение этого клиента
+    client_id = acquire_ws_client().client_id
     workflow = WorkflowDescriptor(
         name="inpaint",
         output_node_ids=["16"]
     )
 
-    if DEBUG:
-        print(f"[INPAINT] Данные редактора: {editor_output.keys()}")
-
-    if translate:
-        positive = translate_text(positive_ru)
-        negative = translate_text(negative_ru) if negative_ru else ""
-    else:
-        positive = positive_ru
-        negative = negative_ru or ""
+    # Базовое изображение и маска из выходных данных ImageEditor
+    base_image, mask = process_editor_output(editor_output, invert_mask)
+    # Воркфлоу всё равно бинаризует маску (ToBinaryMask) -- отправляем сразу 1-битную
+    mask = binarize_mask(mask)
 
-    # Корректная обработка выходных данных ImageEditor
-    base_image = editor_output["background"].convert("RGB")
-    
-    # Создаём правильную маску из слоёв
-    if "layers" in editor_output and editor_output["layers"]:
-        # Берем первый слой с маской (он содержит рисование пользователя)
-        mask_layer = editor_output["layers"][0]
-        
-        if DEBUG:
-            print(f"[INPAINT] Размер основного изображения: {base_image.size}")
-            print(f"[INPAINT] Режим маски: {mask_layer.mode}")
-            print(f"[INPAINT] Размер маски: {mask_layer.size}")
-        
-        # В слое RGBA, альфа канал содержит непрозрачность рисования
-        # Этот канал и есть то, что нарисовал пользователь
-        if mask_layer.mode == 'RGBA':
-            # Извлекаем альфа-канал (это будет наша маска)
-            r, g, b, alpha = mask_layer.split()
-            
-            # Alpha канал содержит непрозрачность: 0=прозрачно, 255=непрозрачно
-            # Превращаем его в маску, где белый (255) = область для inpaint
-            mask = alpha
-            
-            # Если пользователь нарисовал черным, то непрозрачные (255) части должны 
-            # быть областями для inpaint, если не нужно инвертировать
-            if not invert_mask:
-                pass  # оставляем как есть - непрозрачное (255) значит "применить inpaint"
-            else:
-                # Если нужно инвертировать - то непрозрачные части (255) НЕ обрабатываются
-                mask = ImageOps.invert(mask)
-        else:
-            # Для других режимов (например, RGB без альфа)
-            mask_layer = mask_layer.convert("L")
-            
-            # Проверим, какой у нас вариант маски - это может быть черное на белом
-            # или белое на черном, в зависимости от того, как пользователь рисовал
-            
-            # Посчитаем средний уровень яркости маски
-            avg_brightness = sum(mask_layer.getdata()) / (mask_layer.width * mask_layer.height)
-            
-            if DEBUG:
-                print(f"[INPAINT] Средняя яркость маски: {avg_brightness}")
-            
-            # Если маска преимущественно светлая, значит пользователь нарисовал темным
-            # и мы хотим, чтобы темные участки (то что он нарисовал) были заменены
-            if avg_brightness > 128:
-                # Инвертируем, чтобы то, что нарисовал пользователь, стало белым
-                mask = ImageOps.invert(mask_layer)
-            else:
-                # Если пользователь рисовал светлым на темном, оставляем как есть
-                mask = mask_layer
-            
-            # Теперь применяем желание пользователя по инверсии
-            if invert_mask:
-                mask = ImageOps.invert(mask)
-    else:
-        # Если слоев нет, создаем пустую маску
+    # Пустая маска -- заменять нечего: не переводим промпт и не отправляем изображения в ComfyUI
+    if mask.getextrema()[1] == 0:
         if DEBUG:
-            print("[INPAINT] Слои не найдены, создаем пустую маску")
-        mask = Image.new("L", base_image.size, 0)  # Черная маска (ничего не обрабатывается)
-    
-    if DEBUG:
-        # Сохраним оба изображения локально для отладки
-        debug_dir = Path("temp")
-        debug_dir.mkdir(exist_ok=True)
-        debug_base_path = debug_dir / f"base_{uuid.uuid4()}.png"
-        debug_mask_path = debug_dir / f"mask_{uuid.uuid4()}.png"
-        base_image.save(debug_base_path)
-        mask.save(debug_mask_path)
-        print(f"[INPAINT] Отладочные файлы сохранены: {debug_base_path}, {debug_mask_path}")
-
-    # Сохраняем изображения в директорию входных данных ComfyUI
-    rel_base_path = save_image_locally(base_image, "base")
-    rel_mask_path = save_image_locally(mask, "mask")
+            print("[INPAINT] ⚠ Пустая маска, генерация пропущена")
+        raise EmptyMaskError(EMPTY_MASK_MESSAGE)
 
-    if DEBUG:
-        print(f"[INPAINT] Пути для ComfyUI: base={rel_base_path}, mask={rel_mask_path}")
+    # translate_text кэширует результаты, так что повторный запуск с тем же промптом
+    # (подбор маски, seed, LoRA) не обращается к переводчику; оба промпта переводятся одновременно
+    positive, negative = translate_pair(positive_ru, negative_ru) if translate else (positive_ru, negative_ru or "")
 
     patch = {
         "1": {"string": positive},
         "2": {"string": negative},
-        "3": {"image": rel_base_path},
-        "4": {"image": rel_mask_path},
-        "6": {
-            "lora_name": lora_name,
-            "strength_model": lora_strength,
-            "strength_clip": lora_strength
-        } if lora_name else {
-            "strength_model": 0.0,
-            "strength_clip": 0.0
-        },
+        "6": lora_inputs(lora_name, lora_strength),
         "8": {"seed": seed},
     }
 
-    if DEBUG:
-        print(f"[INPAINT] Параметры воркфлоу: {patch}")
-
-    wf = load_and_patch_workflow(workflow.name, patch)
-    prompt_id = queue_prompt(wf, client_id)
-
     def process_preview(preview_data):
         if preview_func:
             try:
@@ -168,10 +68,32 @@ def generate_inpaint(
                 if DEBUG:
                     print(f"[PREVIEW] ⚠ Ошибка при обработке превью: {e}")
 
+    # Большое изображение целиком не влезет в память GPU -- обрабатываем плитками
+    if max(base_image.size) > INPAINT_TILE_THRESHOLD:
+        return _generate_inpaint_tiled(client_id, workflow, base_image, mask, patch, process_preview)
+
+    # Загружаем изображения в ComfyUI (input/NESUPixel) прямо из памяти
+    rel_base_path = upload_image(base_image, "base")
+    rel_mask_path = upload_image(mask, "mask")
+
+    if DEBUG:
+        print(f"[INPAINT] Пути для ComfyUI: base={rel_base_path}, mask={rel_mask_path}")
+
+    patch["3"] = {"image": rel_base_path}
+    patch["4"] = {"image": rel_mask_path}
+
+    if DEBUG:
+        print(f"[INPAINT] Параметры воркфлоу: {patch}")
+
+    wf = load_and_patch_workflow(workflow.name, patch)
+    prompt_id = queue_prompt(wf, client_id)
+
+    # Ждём не дольше сторожа в on_generate (GENERATION_TIMEOUT): он и прерывает зависшую задачу
     result = monitor_until_nodes_ready(
         client_id,
         prompt_id,
         workflow.output_node_ids,
+        timeout=GENERATION_TIMEOUT,
         interrupt_on_ready=True,
         preview_callback=process_preview
     )
@@ -181,9 +103,11 @@ def generate_inpaint(
 
     if not result:
         if DEBUG:
-            print("[INPAINT] Ожидаем 2 секунды и запрашиваем историю снова")
-        time.sleep(2)
-        result = monitor_until_nodes_ready(client_id, prompt_id, workflow.output_node_ids, interrupt_on_ready=False)
+            print("[INPAINT] Запрашиваем историю с нарастающими паузами")
+        result = wait_for_history(prompt_id, workflow.output_node_ids) or monitor_until_nodes_ready(
+            client_id, prompt_id, workflow.output_node_ids,
+            timeout=GENERATION_TIMEOUT, interrupt_on_ready=False, preview_callback=process_preview
+        )
         if DEBUG:
             print(f"[INPAINT] Результат после повторного запроса: {result}")
 
@@ -194,76 +118,81 @@ def generate_inpaint(
             file_info = images[0]
             filename = file_info['filename']
             subfolder = file_info.get('subfolder', '')
-            url = f"{COMFY_API_URL}/view?filename={filename}&subfolder={subfolder}"
-            
-            # Корректируем путь к файлу (строковая операция, а не операция с Path)
-            path_str = str(COMFY_OUTPUT_PATH)
-            correct_path = Path(path_str) / subfolder / filename
-            
-            # Альтернативный путь (без дублирования NESUPixel)
-            if "NESUPixel" in path_str:
-                alt_path_str = path_str.replace("NESUPixel", "", 1)  # заменяем только первое вхождение
-                alt_path = Path(alt_path_str) / subfolder / filename
-            else:
-                alt_path = correct_path
+            url = view_url(filename, subfolder)
             
+            # Основной, альтернативный (без дублирования NESUPixel) и третий путь (исходя из логов)
+            # перебирает find_output_image -- по одному stat на путь
+            found_path = find_output_image(filename, subfolder)
+            if found_path:
+                if DEBUG:
+                    print(f"[INPAINT] Файл найден: {found_path}")
+                return url, str(found_path)
+
+            # Попробуем скачать файл через URL (общая сессия с keep-alive, потоково на диск)
             if DEBUG:
-                print(f"[INPAINT] Пробуем пути: {correct_path} или {alt_path}")
-            
-            # Третий вариант пути (исходя из логов)
-            output_folder = Path("output") 
-            third_path = output_folder / "NESUPixel" / subfolder / filename
+                print(f"[INPAINT] Пытаемся скачать через URL: {url}")
+            temp_file = download_image(url, filename)
+            if temp_file:
+                return url, str(temp_file)
             
             if DEBUG:
-                print(f"[INPAINT] Также пробуем путь: {third_path}")
-            
-            # Пробуем все возможные пути
-            if correct_path.exists():
-                if DEBUG:
-                    print(f"[INPAINT] Файл найден по основному пути: {correct_path}")
-                return url, str(correct_path)
-            elif alt_path.exists():
-                if DEBUG:
-                    print(f"[INPAINT] Файл найден по альтернативному пути: {alt_path}")
-                return url, str(alt_path)
-            elif third_path.exists():
-                if DEBUG:
-                    print(f"[INPAINT] Файл найден по третьему пути: {third_path}")
-                return url, str(third_path)
-            else:
-                # Попробуем скачать файл через URL
-                try:
-                    import requests
-                    if DEBUG:
-                        print(f"[INPAINT] Пытаемся скачать через URL: {url}")
-                    
-                    response = requests.get(url)
-                    if response.status_code == 200:
-                        # Сохраняем в локальной директории temp
-                        temp_dir = Path("temp")
-                        temp_dir.mkdir(exist_ok=True)
-                        temp_file = temp_dir / filename
-                        
-                        with open(temp_file, "wb") as f:
-                            f.write(response.content)
-                        
-                        if DEBUG:
-                            print(f"[INPAINT] Файл скачан и сохранен: {temp_file}")
-                        
-                        return url, str(temp_file)
-                except Exception as e:
-                    if DEBUG:
-                        print(f"[INPAINT] ⚠ Ошибка при скачивании: {e}")
-                
-                if DEBUG:
-                    print(f"[INPAINT] ⚠ Файл не найден по путям, возвращаем только URL")
-                # Если не удалось найти файл, возвращаем только URL
-                return url, None
+                print(f"[INPAINT] ⚠ Файл не найден по путям, возвращаем только URL")
+            # Если не удалось найти файл, возвращаем только URL
+            return url, None
     
     if DEBUG:
         print("[INPAINT] ⚠ Не удалось получить результат")
     return "", None
 
+def _generate_inpaint_tiled(client_id, workflow, base_image, mask, patch, process_preview):
+    """
+    Inpaint большого изображения плитками с перекрытием.
+
+    Плитки без маски пропускаются, остальные отправляются в очередь ComfyUI сразу все,
+    а результаты смешиваются окном Ханна (см. blend_tiles) и сохраняются в temp.
+    """
+    output_node_id = workflow.output_node_ids[0]
+
+    jobs = []
+    for box in tile_boxes(*base_image.size, INPAINT_TILE_SIZE, INPAINT_TILE_OVERLAP):
+        tile_mask = mask.crop(box)
+        if tile_mask.getextrema()[1] == 0:
+            continue
+        tile_patch = {
+            **patch,
+            "3": {"image": upload_image(base_image.crop(box), "base_tile")},
+            "4": {"image": upload_image(tile_mask, "mask_tile")},
+        }
+        jobs.append((box, queue_prompt(load_and_patch_workflow(workflow.name, tile_patch), client_id)))
+
+    if DEBUG:
+        print(f"[INPAINT] Изображение {base_image.size} разбито на плитки, в работе: {len(jobs)}")
+
+    tiles = []
+    for i, (box, prompt_id) in enumerate(jobs):
+        # Как и без плиток: ждём по WebSocket до GENERATION_TIMEOUT, затем добираем из истории
+        result = monitor_until_nodes_ready(
+            client_id, prompt_id, workflow.output_node_ids,
+            timeout=GENERATION_TIMEOUT, preview_callback=process_preview
+        ) or wait_for_history(prompt_id, workflow.output_node_ids)
+        _, file_path = get_output_image_info(result, output_node_id)
+        if not file_path:
+            # Прервано или ошибка -- оставшиеся плитки не нужны
+            print(f"[INPAINT] ⚠ Нет результата для плитки {box}")
+            delete_queued([pid for _, pid in jobs[i + 1:]])
+            return "", None
+        with Image.open(file_path) as tile_image:
+            tiles.append((box, tile_image.convert("RGB")))
+
+    temp_file = TEMP_PATH / f"inpaint_tiled_{uuid.uuid4()}.png"
+    blend_tiles(base_image, tiles).save(temp_file, format="PNG", compress_level=1)
+
+    if DEBUG:
+        print(f"[INPAINT] Плитки собраны: {temp_file}")
+
+    # Результат есть только локально -- путь к файлу служит и ссылкой для gr.Image
+    return str(temp_file), str(temp_file)
+
 def create_inpaint_ui():
     with gr.Tab("Inpaint (замена области)"):
         with gr.Row():
@@ -287,7 +216,7 @@ def create_inpaint_ui():
                 invert_mask = gr.Checkbox(label="Инвертировать маску (по умолчанию черное заменяется)", value=False)
 
                 with gr.Accordion("LoRA (дополнительно)", open=False):
-                    lora_alias = gr.Dropdown(choices=[p["alias"] for p in LORA_PRESETS], label="Выбрать стиль", allow_custom_value=True)
+                    lora_alias = gr.Dropdown(choices=list(LORA_ALIASES), label="Выбрать стиль", allow_custom_value=True)
                     lora_path = gr.Textbox(label="LoRA путь (авто из стиля)", interactive=True)
                     lora_strength = gr.Slider(0, 1, value=0.0, step=0.05, label="Сила LoRA")
 
@@ -302,13 +231,6 @@ def create_inpaint_ui():
                 status_text = gr.Textbox(label="Статус", value="Готов к генерации", interactive=False)
                 download = gr.File(label="Скачать результат")
 
-        def apply_lora_preset(alias):
-            preset = LORA_ALIAS_MAP.get(alias)
-            if not preset:
-                return gr.update(), gr.update()
-            return preset["filename"], preset.get("recommended_strength", 0.7)
-
-        preview_images = []
         is_generating = threading.Event()
 
         def on_interrupt():
@@ -318,20 +240,34 @@ def create_inpaint_ui():
             return gr.update(value="Нет активной генерации")
 
         def on_generate(*args):
-            nonlocal preview_images
             is_generating.set()
-            preview_images.clear()
             yield gr.update(value=None), gr.update(value="Начало генерации..."), gr.update(value=None)
 
+            # Превью передаются из потока генерации через очередь: цикл ниже спит в get()
+            # и просыпается сразу при новом кадре или завершении (None)
+            preview_queue = queue.SimpleQueue()
+
             def preview_handler(img):
-                nonlocal preview_images
-                preview_images.append(img)
+                preview_queue.put(img)
                 if DEBUG:
-                    print(f"[UI] Получено новое превью #{len(preview_images)}, размер: {img.size}")
+                    print(f"[UI] Получено новое превью, размер: {img.size}")
 
             generation_result = [None, None]
+            generation_error = [None]
             generation_complete = threading.Event()
 
+            # Сторож: ожидание превью ниже не ограничено по времени (длинные и плиточные генерации
+            # показывают превью до конца), а реальный таймаут прерывает задачу в ComfyUI
+            def on_timeout():
+                print(f"[GENERATION] ⚠ Превышено время генерации ({GENERATION_TIMEOUT} с), прерываем")
+                generation_error[0] = f"Превышено время генерации ({GENERATION_TIMEOUT} с)"
+                interrupt()
+                generation_complete.set()
+                preview_queue.put(None)
+
+            watchdog = threading.Timer(GENERATION_TIMEOUT, on_timeout)
+            watchdog.daemon = True
+
             def run_generation():
                 nonlocal generation_result
                 try:
@@ -343,37 +279,39 @@ def create_inpaint_ui():
                     generation_result[1] = result[1]  # file_path
                     if DEBUG:
                         print(f"[UI] Результат генерации: URL={result[0]}, Path={result[1]}")
+                except EmptyMaskError as e:
+                    # Пустая маска -- показываем сообщение пользователю
+                    generation_error[0] = str(e)
                 except Exception as e:
                     print(f"[GENERATION] Ошибка: {e}")
-                    import traceback
                     traceback.print_exc()
                 finally:
+                    watchdog.cancel()
                     generation_complete.set()
                     is_generating.clear()
+                    preview_queue.put(None)  # будим цикл ожидания превью
 
             generation_thread = threading.Thread(target=run_generation, daemon=True)
+            watchdog.start()
             generation_thread.start()
 
-            last_preview_count = 0
-            poll_interval = 0.1
-            max_polls = int(30 / poll_interval)  # 30 секунд максимум
+            preview_count = 0
+            latest_preview = None
 
-            for _ in range(max_polls):
-                if generation_complete.is_set():
+            while not generation_complete.is_set():
+                try:
+                    img = preview_queue.get(timeout=0.25)
+                except queue.Empty:
+                    continue
+                if img is None:
                     break
-                current_preview_count = len(preview_images)
-                if current_preview_count > last_preview_count:
-                    last_preview_count = current_preview_count
-                    latest_preview = preview_images[-1]
-                    if DEBUG:
-                        print(f"[UI] Отображаем превью #{current_preview_count}")
-                    yield gr.update(value=latest_preview), gr.update(value=f"Генерация... Превью {current_preview_count}"), gr.update(value=None)
-                time.sleep(poll_interval)
-
-            if not generation_complete.is_set():
+                preview_count += 1
+                latest_preview = img
                 if DEBUG:
-                    print("[UI] Ожидаем завершения генерации...")
-                generation_complete.wait()
+                    print(f"[UI] Отображаем превью #{preview_count}")
+                yield gr.update(value=img), gr.update(value=f"Генерация... Превью {preview_count}"), gr.update(value=None)
+
+            generation_complete.wait()
 
             url, file_path = generation_result
             if DEBUG:
@@ -382,27 +320,13 @@ def create_inpaint_ui():
             if url:
                 # Если есть URL, но нет файла, пробуем скачать изображение
                 if not file_path or not Path(file_path).exists():
-                    try:
-                        import requests
-                        if DEBUG:
-                            print(f"[UI] Скачиваем изображение по URL: {url}")
-                        
-                        response = requests.get(url)
-                        if response.status_code == 200:
-                            temp_dir = Path("temp")
-                            temp_dir.mkdir(exist_ok=True)
-                            temp_file = temp_dir / f"inpaint_{uuid.uuid4()}.png"
-                            
-                            with open(temp_file, "wb") as f:
-                                f.write(response.content)
-                            
-                            if DEBUG:
-                                print(f"[UI] Файл скачан: {temp_file}")
-                            
-                            file_path = str(temp_file)
-                    except Exception as e:
-                        if DEBUG:
-                            print(f"[UI] Ошибка при скачивании: {e}")
+                    if DEBUG:
+                        print(f"[UI] Скачиваем изображение по URL: {url}")
+                    # Показываем картинку, декодированную из скачанных байт, -- без повторного чтения файла
+                    img, temp_file = fetch_image(url, f"inpaint_{uuid.uuid4()}.png")
+                    if img is not None:
+                        yield gr.update(value=img), gr.update(value="Генерация завершена!"), str(temp_file)
+                        return
                 
                 # Пробуем отображать изображение через путь к файлу, а не URL
                 if file_path and Path(file_path).exists():
@@ -428,20 +352,32 @@ def create_inpaint_ui():
                     if DEBUG:
                         print(f"[UI] Ошибка при отображении URL: {e}")
                     # Пробуем отобразить последнее превью
-                    if preview_images:
+                    if latest_preview is not None:
                         if DEBUG:
                             print(f"[UI] Отображаем последнее превью вместо результата")
-                        yield gr.update(value=preview_images[-1]), gr.update(value="⚠️ Проблема с отображением результата. Используйте ссылку для скачивания."), file_path
+                        yield gr.update(value=latest_preview), gr.update(value="⚠️ Проблема с отображением результата. Используйте ссылку для скачивания."), file_path
                     else:
                         yield gr.update(value=None), gr.update(value="⚠️ Не удалось отобразить результат"), file_path
             else:
-                yield gr.update(value=None), gr.update(value="Ошибка генерации или прервано"), None
+                yield gr.update(value=None), gr.update(value=generation_error[0] or "Ошибка генерации или прервано"), None
 
         lora_alias.change(apply_lora_preset, inputs=[lora_alias], outputs=[lora_path, lora_strength])
 
+        # Переводим промпты заранее, пока пользователь рисует маску и подбирает параметры
+        def prewarm_positive(text, enabled):
+            if enabled:
+                prewarm_translation(text, "inpaint_positive")
+
+        def prewarm_negative(text, enabled):
+            if enabled:
+                prewarm_translation(text, "inpaint_negative")
+
+        prompt.change(prewarm_positive, inputs=[prompt, translate], outputs=None, show_progress="hidden", queue=False)
+        negative.change(prewarm_negative, inputs=[negative, translate], outputs=None, show_progress="hidden", queue=False)
+
         generate_btn.click(
             on_generate,
-            inputs=[prompt, negative, draw, draw, invert_mask, lora_path, lora_strength, seed, translate, assistant],
+            inputs=[prompt, negative, draw, invert_mask, lora_path, lora_strength, seed, translate, assistant],
             outputs=[image_output, status_text, download]
         )
 
@@ -3,35 +3,86 @@ import gradio as gr
 import uuid
 import time
 import io
-import requests
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from core.comfy_api import generate_client_id, queue_prompt, load_and_patch_workflow, monitor_until_nodes_ready, interrupt
+from core.comfy_api import acquire_ws_client, queue_prompt, load_and_patch_workflow, monitor_until_nodes_ready, wait_for_history, interrupt, view_url
 from core.workflow_descriptor import WorkflowDescriptor
-from core.translate_utils import translate_text
-from core.settings import DEBUG, COMFY_API_URL, COMFY_OUTPUT_PATH, DEFAULT_WIDTH, DEFAULT_HEIGHT, DEFAULT_NEGATIVE_PROMPT, DEFAULT_SEED
-from core.lora_utils import load_lora_presets
+from core.translate_utils import translate_pair
+from core.settings import DEBUG, COMFY_OUTPUT_PATH, DEFAULT_WIDTH, DEFAULT_HEIGHT, DEFAULT_NEGATIVE_PROMPT, DEFAULT_SEED
+from core.lora_utils import LORA_ALIASES, apply_lora_preset, lora_inputs
+from core.image_utils import download_image
 from pathlib import Path
 
-# Глобально кэшируем пресеты
-LORA_PRESETS = load_lora_presets()
-LORA_ALIAS_MAP = {preset["alias"]: preset for preset in LORA_PRESETS}
+# Пул потоков генерации: ограничивает число одновременных генераций при частых нажатиях
+# и не создаёт новый поток на каждый запуск
+_GEN_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="txt2img")
 
-def generate_txt2img(
+# Число активных генераций (в _GEN_POOL их может быть несколько одновременно).
+# Меняют потоки генерации под _state_lock, on_interrupt читает без блокировки:
+# устаревшее значение безвредно, а состояние задачи знает сам ComfyUI
+_state = {"active": 0}
+_state_lock = threading.Lock()
+
+# Директория результатов ComfyUI (Path строится один раз, а не на каждую генерацию)
+_COMFY_OUT = Path(COMFY_OUTPUT_PATH) if COMFY_OUTPUT_PATH else None
+
+# Паузы (секунды) между проверками локального файла результата перед скачиванием по сети
+LOCAL_FILE_RETRY_DELAYS = (0, 0.05, 0.1, 0.2)
+
+# Превью больше этого размера (по длинной стороне) уменьшаем перед отправкой в браузер
+PREVIEW_MAX_SIDE = 512
+# Минимальный интервал (секунды) между декодируемыми кадрами превью
+PREVIEW_MIN_INTERVAL = 0.1
+
+
+class LatestPreview:
+    """
+    Ячейка с последним кадром превью. Старые кадры не копятся: новый просто заменяет
+    предыдущий, а номер версии позволяет UI показывать каждый кадр не больше одного раза.
+    Кадры и завершение генерации сообщаются через одно условие (Condition), поэтому
+    ожидающий поток просыпается только тогда, когда есть что показать или пора заканчивать.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.image = None
+        self.version = 0
+        self.finished = False
+
+    def put(self, image):
+        with self._cond:
+            self.image = image
+            self.version += 1
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def wait_newer(self, seen_version: int, timeout: float):
+        """Ждёт кадр новее seen_version или завершения; возвращает (кадр, версия, завершено)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > seen_version or self.finished, timeout)
+            return self.image, self.version, self.finished
+
+def _run_txt2img(
     positive_ru, negative_ru, width, height,
     lora_name, lora_strength,
     seed, translate, use_prompt_assistant,
     preview_func=None  # Функция обратного вызова для превью
 ):
-    client_id = generate_client_id()
+    # События генерации приходят в заранее открытое WebSocket-соединение этого клиента
+    client_id = acquire_ws_client().client_id
     workflow = WorkflowDescriptor(
         name="txt2img",
         output_node_ids=["16"]
     )
 
+    # Позитивный и негативный промпт переводятся одновременно; пустой негативный не переводится
     if translate:
-        positive = translate_text(positive_ru)
-        negative = translate_text(negative_ru) if negative_ru else ""
+        positive, negative = translate_pair(positive_ru, negative_ru)
     else:
         positive = positive_ru
         negative = negative_ru or ""
@@ -44,31 +95,33 @@ def generate_txt2img(
         "2": {"string": negative},
         "3": {"int": width},
         "4": {"int": height},
+        "6": lora_inputs(lora_name, lora_strength),
         "8": {"seed": seed},
     }
 
-    if lora_name:
-        patch["6"] = {
-            "lora_name": lora_name,
-            "strength_model": lora_strength,
-            "strength_clip": lora_strength
-        }
-    else:
-        patch["6"] = {
-            "strength_model": 0.0,
-            "strength_clip": 0.0
-        }
-
     wf = load_and_patch_workflow(workflow.name, patch)
 
     prompt_id = queue_prompt(wf, client_id)
     
+    # Время последнего декодированного превью (для ограничения частоты кадров)
+    last_preview_ts = [0.0]
+
     # Функция для обработки бинарных превью
     def process_preview(preview_data):
         if preview_func:
+            # Браузер всё равно не успеет показать больше ~10 кадров в секунду --
+            # кадры, пришедшие раньше PREVIEW_MIN_INTERVAL после предыдущего, не декодируем
+            now = time.monotonic()
+            if now - last_preview_ts[0] < PREVIEW_MIN_INTERVAL:
+                return
+            last_preview_ts[0] = now
             try:
-                # Открываем изображение из бинарных данных
+                # Открываем изображение из бинарных данных и декодируем сразу, в потоке превью:
+                # дальше по цепочке (UI, Gradio) кадр уже готовый, в RGB, без повторного разбора JPEG
                 preview_image = Image.open(io.BytesIO(preview_data))
+                preview_image.load()
+                if preview_image.mode != "RGB":
+                    preview_image = preview_image.convert("RGB")
                 if DEBUG:
                     print(f"[PREVIEW] Успешно получено превью: {preview_image.size}")
                 preview_func(preview_image)
@@ -85,12 +138,14 @@ def generate_txt2img(
         preview_callback=process_preview  # Передаем функцию обработки превью
     )
 
-    # Подождать немного перед запросом истории (например, 2 секунды)
+    # Результата нет -- опрашиваем историю с нарастающими паузами (обычно он там уже есть),
+    # а если генерация ещё идёт, снова ждём её по WebSocket
     if not result:
         if DEBUG:
-            print("[WAIT] ⏳ Подождём перед запросом истории...")
-        time.sleep(2)
-        result = monitor_until_nodes_ready(client_id, prompt_id, workflow.output_node_ids, interrupt_on_ready=False)
+            print("[WAIT] ⏳ Запрашиваем историю...")
+        result = wait_for_history(prompt_id, workflow.output_node_ids) or monitor_until_nodes_ready(
+            client_id, prompt_id, workflow.output_node_ids, interrupt_on_ready=False
+        )
 
     if result and "16" in result:
         images = result["16"].get("images", [])
@@ -100,32 +155,91 @@ def generate_txt2img(
             subfolder = file_info.get('subfolder', '')
             
             # Формируем URL для просмотра
-            url = f"{COMFY_API_URL}/view?filename={filename}&subfolder={subfolder}"
+            url = view_url(filename, subfolder)
             
             # Формируем путь для скачивания (может потребоваться настройка)
             # Получаем полное имя файла
-            file_path = Path(COMFY_OUTPUT_PATH) / subfolder / filename if COMFY_OUTPUT_PATH else None
-            if file_path and file_path.exists():
-                return url, str(file_path)
-            else:
-                # Если файл не найден локально, пробуем скачать его
-                try:
-                    response = requests.get(url)
-                    if response.status_code == 200:
-                        temp_dir = Path("temp")
-                        temp_dir.mkdir(exist_ok=True)
-                        temp_file = temp_dir / filename
-                        with open(temp_file, "wb") as f:
-                            f.write(response.content)
-                        return url, str(temp_file)
-                except Exception as e:
-                    print(f"Ошибка при скачивании файла: {e}")
+            file_path = _COMFY_OUT / subfolder / filename if _COMFY_OUT else None
+            if file_path:
+                # ComfyUI может дописывать файл в момент события -- коротко подождём его на диске,
+                # прежде чем качать ту же картинку по сети
+                for delay in LOCAL_FILE_RETRY_DELAYS:
+                    if delay:
+                        time.sleep(delay)
+                    if file_path.is_file():
+                        return url, str(file_path)
+            
+            # Если файл не найден локально, скачиваем его потоково через общую сессию
+            temp_file = download_image(url, filename)
+            if temp_file:
+                return url, str(temp_file)
                     
             # Если не удалось получить файл, возвращаем только URL
             return url, None
     return "", None
 
 
+def generate_txt2img(
+    positive_ru, negative_ru, width, height,
+    lora_name, lora_strength,
+    seed, translate, use_prompt_assistant,
+):
+    """
+    Генерация txt2img в виде потока событий для Gradio.
+
+    Выдаёт ("preview", изображение) по мере прихода превью (только самые свежие кадры)
+    и в конце ("done", url, путь_к_файлу). Ошибка генерации пробрасывается вызывающему.
+    Сама генерация ждёт ComfyUI в пуле потоков: превью приходят из потока WebSocket.
+    """
+    latest = LatestPreview()
+
+    def preview_handler(img):
+        # Уменьшаем в потоке превью, а не в UI: в браузер уходит меньше данных
+        img.thumbnail((PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE))
+        latest.put(img)
+        if DEBUG:
+            print(f"[UI] Получено новое превью, размер: {img.size}")
+
+    def run_generation():
+        with _state_lock:
+            _state["active"] += 1
+        try:
+            return _run_txt2img(
+                positive_ru, negative_ru, width, height,
+                lora_name, lora_strength,
+                seed, translate, use_prompt_assistant,
+                preview_func=preview_handler,
+            )
+        finally:
+            with _state_lock:
+                _state["active"] -= 1
+            latest.finish()  # будим цикл ожидания превью
+
+    future = _GEN_POOL.submit(run_generation)
+
+    last_seen_version = 0
+    # Превью показываем не дольше 30 секунд реального времени
+    deadline = time.monotonic() + 30.0
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        image, version, finished = latest.wait_newer(last_seen_version, remaining)
+
+        # Показываем только самый свежий кадр и только если он новый
+        if version > last_seen_version:
+            if DEBUG:
+                print(f"[UI] Показываем превью #{version} (пропущено {version - last_seen_version - 1})")
+            last_seen_version = version
+            yield "preview", image
+        if finished:
+            break
+
+    url, file_path = future.result()
+    yield "done", url, file_path
+
+
 def create_txt2img_ui():
     with gr.Tab("Text to Image"):
         with gr.Row():
@@ -140,7 +254,7 @@ def create_txt2img_ui():
                     height = gr.Slider(512, 1600, value=DEFAULT_HEIGHT, step=64, label="Высота")
 
                 with gr.Accordion("LoRA (дополнительно)", open=False):
-                    lora_alias = gr.Dropdown(choices=[p["alias"] for p in LORA_PRESETS], label="Выбрать стиль", allow_custom_value=True)
+                    lora_alias = gr.Dropdown(choices=list(LORA_ALIASES), label="Выбрать стиль", allow_custom_value=True)
                     lora_path = gr.Textbox(label="LoRA путь (авто из стиля)", interactive=True)
                     lora_strength = gr.Slider(0, 1, value=0.0, step=0.05, label="Сила LoRA")
 
@@ -156,20 +270,8 @@ def create_txt2img_ui():
                 status_text = gr.Textbox(label="Статус", value="Готов к генерации", interactive=False)
                 download = gr.File(label="Скачать результат")
 
-        def apply_lora_preset(alias):
-            preset = LORA_ALIAS_MAP.get(alias)
-            if not preset:
-                return gr.update(), gr.update()
-            return preset["filename"], preset.get("recommended_strength", 0.7)
-
-        # Глобальный список для хранения превью между вызовами
-        # (нужно для совместного использования между генератором и функцией обратного вызова)
-        preview_images = []
-        # Переменная для отслеживания состояния генерации
-        is_generating = threading.Event()
-
         def on_interrupt():
-            if is_generating.is_set():
+            if _state["active"] > 0:
                 success = interrupt()
                 if DEBUG:
                     print(f"[INTERRUPT] Прерывание отправлено: {'успешно' if success else 'ошибка'}")
@@ -177,73 +279,22 @@ def create_txt2img_ui():
             return gr.update(value="Нет активной генерации")
 
         def on_generate(*args):
-            nonlocal preview_images
-            # Устанавливаем флаг активной генерации
-            is_generating.set()
-            
-            # Очищаем список превью перед новой генерацией
-            preview_images.clear()
-            
             # Очищаем изображение и устанавливаем статус
             yield gr.update(value=None), gr.update(value="Начало генерации..."), gr.update(value=None)
             
-            # Функция обратного вызова для получения превью
-            def preview_handler(img):
-                nonlocal preview_images
-                preview_images.append(img)
-                if DEBUG:
-                    print(f"[UI] Получено новое превью #{len(preview_images)}, размер: {img.size}")
-            
-            # Запускаем генерацию с функцией обновления превью
-            generation_result = [None, None]  # [url, file_path]
-            generation_complete = threading.Event()
-            
-            # Запускаем генерацию в отдельном потоке
-            def run_generation():
-                nonlocal generation_result
-                try:
-                    result = generate_txt2img(*args, preview_func=preview_handler)
-                    generation_result[0] = result[0]  # url
-                    generation_result[1] = result[1]  # file_path
-                except Exception as e:
-                    print(f"[GENERATION] Ошибка: {e}")
-                finally:
-                    generation_complete.set()
-                    is_generating.clear()  # Сбрасываем флаг генерации
-            
-            generation_thread = threading.Thread(target=run_generation)
-            generation_thread.daemon = True
-            generation_thread.start()
-            
-            # Показываем превью в процессе генерации
-            last_preview_count = 0
-            poll_interval = 0.1  # Интервал проверки в секундах
-            max_polls = int(30 / poll_interval)  # Максимальное время ожидания 30 секунд
-            
-            for _ in range(max_polls):
-                if generation_complete.is_set():
-                    break
-                    
-                # Проверяем, есть ли новые превью
-                current_preview_count = len(preview_images)
-                if current_preview_count > last_preview_count:
-                    if DEBUG:
-                        print(f"[UI] Найдены новые превью: было {last_preview_count}, стало {current_preview_count}")
-                    
-                    # Есть новое превью, показываем его
-                    last_preview_count = current_preview_count
-                    latest_preview = preview_images[-1]
-                    yield gr.update(value=latest_preview), gr.update(value=f"Генерация... Получено превью {current_preview_count}"), gr.update(value=None)
-                
-                # Ждем немного перед следующей проверкой
-                time.sleep(poll_interval)
-            
-            # Ждем завершения генерации, если еще не завершена
-            if not generation_complete.is_set():
-                generation_complete.wait()
+            preview_count = 0
+            url, file_path = None, None
+            try:
+                for event in generate_txt2img(*args):
+                    if event[0] == "preview":
+                        preview_count += 1
+                        yield gr.update(value=event[1]), gr.update(value=f"Генерация... Получено превью {preview_count}"), gr.update(value=None)
+                    else:
+                        _, url, file_path = event
+            except Exception as e:
+                print(f"[GENERATION] Ошибка: {e}")
             
             # Показываем окончательный результат
-            url, file_path = generation_result
             if url:
                 if DEBUG:
                     print(f"[UI] Генерация завершена. URL: {url}, Path: {file_path}")